@@ -1,104 +1,208 @@
-import requests 
-import pandas as pd 
+import pandas as pd
+import pyarrow as pa
+import pyarrow.compute as pc
+import pyarrow.parquet as pq
+from pyarrow import csv as pacsv
 import os
 import subprocess
 import time
 import sys
-from requests.exceptions import ChunkedEncodingError, Timeout, ConnectionError
+import gzip
+import logging
+import re
+from http.client import IncompleteRead
+from urllib.error import HTTPError, URLError
+from urllib.request import Request, urlopen
+
+logger = logging.getLogger(__name__)
+
+# Default read size for the download (1 MiB), overridable via CFIA_CHUNK_SIZE
+DEFAULT_CHUNK_SIZE = 1 << 20
+
+# Minimum block size used by the Arrow CSV reader (8 MiB). Every record must fit in one block,
+# so the parser never uses a smaller block even if CFIA_CHUNK_SIZE is set lower
+READ_BLOCK_SIZE = 8 << 20
+
+# Columns used by the later pipeline stages and their types, so nothing else is parsed
+# ('Last updated' is parsed once here as a date and stays one through to SQL Server)
+COLUMN_TYPES = {
+    "NID": pa.int64(),
+    "Title": pa.string(),
+    "URL": pa.string(),
+    "Product": pa.string(),
+    "Issue": pa.string(),
+    "Category": pa.string(),
+    "Recall class": pa.string(),
+    "Last updated": pa.date32(),
+    "Archived": pa.int8(),
+}
+COLUMNS = list(COLUMN_TYPES)
+
+# Key food safety issues to keep; Listeria recalls of medical devices are left out
+FOOD_ISSUE_PATTERN = re.compile(
+    r"(?!.*(?i:listeria - medical devices)).*?(?:Salmonella|Listeria|E. Coli)",
+    re.DOTALL,
+)
+
+def get_chunk_size() -> int:
+    """
+    Reads the download chunk size from the CFIA_CHUNK_SIZE environment variable.
+
+    The Arrow CSV reader parses the download in blocks of this size, but never smaller than
+    READ_BLOCK_SIZE. A block shorter than the longest record would fail to parse, so small
+    values are raised to READ_BLOCK_SIZE and only larger values change the block size.
 
-def download_raw_csv(url: str, folder: str) -> str:
+    Returns:
+        int: Chunk size in bytes, or DEFAULT_CHUNK_SIZE if the variable is not set.
     """
-    Downloads the CFIA raw CSV file from the given URL and saves it to the specified folder.
+    value = os.getenv("CFIA_CHUNK_SIZE")
+    if value is None:
+        return DEFAULT_CHUNK_SIZE
 
-    Args:
-        url (str): The URL to download the CSV from.
-        folder (str): The local folder to save the downloaded file.
+    try:
+        chunk_size = int(value)
+    except ValueError:
+        raise ValueError(f"CFIA_CHUNK_SIZE must be an integer, got {value!r}.")
+
+    if chunk_size <= 0:
+        raise ValueError(f"CFIA_CHUNK_SIZE must be a positive integer, got {chunk_size}.")
+    return chunk_size
+
+def write_csv_enabled() -> bool:
+    """
+    Reads the CFIA_WRITE_CSV environment variable to decide whether CSV copies of the
+    Parquet files handed between the pipeline steps are also written.
 
     Returns:
-        str: Path to the saved raw CSV file.
+        bool: False if the variable is set to 0, false or no, True otherwise (the default).
     """
-    # Save raw file
-    file_name = "cfia_recalls_raw.csv"
-    file_path = os.path.join(folder, file_name)
+    return os.getenv("CFIA_WRITE_CSV", "1").strip().lower() not in ("0", "false", "no")
 
-    # Make sure the folder exists
-    os.makedirs(folder, exist_ok=True)
+def food_issue_mask(issues: pa.Array) -> pa.Array:
+    """
+    Builds a boolean mask of the issues that match FOOD_ISSUE_PATTERN.
 
-    print("Downloading data...")
-    
-    max_retries = 5
+    The column is dictionary-encoded first, so the pattern runs once per distinct
+    issue instead of once per row.
 
-    for attempt in range(1, max_retries + 1):
-        try:
-            # Send HTTP GET request to download CSV
-            response = requests.get(url, stream=True, timeout=200) 
-            response.raise_for_status() # Raises for non-200 status codes
-            with open(file_path, "wb") as f:
-                # Extract in in chunks since it is a big file
-                chunk_size = int(os.getenv("CFIA_CHUNK_SIZE", 8192))
-                for chunk in response.iter_content(chunk_size=chunk_size):
-                    if chunk:
-                        f.write(chunk)
-            print(f"Raw data saved as: {file_path}")
-            return file_path
-        except (ChunkedEncodingError, Timeout, ConnectionError) as e:
-            delay = 5 * attempt
-            print(f"Attempt {attempt}: {type(e).__name__} - {e}. Retrying in {delay} seconds...")
-            time.sleep(delay)
-        except requests.HTTPError as e:
-            raise Exception(f"HTTP error {response.status_code} while downloading file: {e}")
+    Args:
+        issues (pa.Array): The 'Issue' column of a block of recall records.
 
-def filter_food_recalls(input_path: str, output_path: str) -> int:
+    Returns:
+        pa.Array: True for rows with a food safety issue, False otherwise (including missing issues).
     """
-    Filters the raw CSV file for food-related recalls and saves it to a new file.
+    encoded = pc.dictionary_encode(issues)
+    matches = pa.array(
+        [FOOD_ISSUE_PATTERN.match(issue) is not None for issue in encoded.dictionary.to_pylist()],
+        type=pa.bool_(),
+    )
+    return pc.fill_null(matches.take(encoded.indices), False)
+
+def extract_food_recalls(url: str, output_path: str) -> pa.Table:
+    """
+    Downloads the CFIA raw CSV file from the given URL and filters it for food-related recalls
+    in a single pass, saving only the filtered records as Parquet (plus a CSV copy if enabled).
+
+    The response is parsed block by block while it downloads, so the raw file is never
+    written to disk or loaded into memory as a whole.
 
     Args:
-        input_path (str): Path to the raw CSV file.
-        output_path (str): Path to save the filtered CSV file.
+        url (str): The URL to download the CSV from.
+        output_path (str): Path to save the filtered Parquet file.
 
     Returns:
-        int: Number of food recall records found.
+        pa.Table: The food recall records found.
     """
-    print("\nFiltering food recalls...")
+    # Make sure the folder exists
+    os.makedirs(os.path.dirname(output_path) or ".", exist_ok=True)
 
-    # Load the raw data into a DataFrame
-    df = pd.read_csv(input_path) 
+    logger.info("Downloading and filtering food recalls...")
 
-    # Check if 'Issue' column exists and filter for key food safety issues
-    if 'Issue' in df.columns: 
-        filtered_df = df[
-                            df['Issue'].str.contains("Salmonella|Listeria|E. Coli", na=False) &
-                            ~df['Issue'].str.contains("Listeria - Medical devices", case=False, na=False)
-                        ]
+    max_retries = 5
+    chunk_size = get_chunk_size()
 
-        # Save filtered records to a new CSV
-        filtered_df.to_csv(output_path, index=False)
+    # Ask for a compressed response to reduce the bytes transferred
+    request = Request(url, headers={"Accept-Encoding": "gzip"})
 
-        print(f"Filtered food recalls saved as: {output_path}") 
-        print(f"\nFound {len(filtered_df)} food recalls.")
-    else:
-        # Raise error if expected column is missing
-        raise ValueError("'Issue' column not found in dataset.")
+    for attempt in range(1, max_retries + 1):
+        try:
+            # Send HTTP GET request to download CSV (non-200 status codes raise HTTPError)
+            with urlopen(request, timeout=200) as response:
+                body = response
+                if response.headers.get("Content-Encoding") == "gzip":
+                    # Decompress transparently while reading
+                    body = gzip.GzipFile(fileobj=response)
+
+                try:
+                    # Stream only the needed columns through the Arrow reader, one block at a time
+                    # (the first block is already read here, so a short body can fail at this point)
+                    try:
+                        reader = pacsv.open_csv(
+                            body,
+                            read_options=pacsv.ReadOptions(block_size=max(chunk_size, READ_BLOCK_SIZE)),
+                            convert_options=pacsv.ConvertOptions(
+                                include_columns=COLUMNS,
+                                column_types=COLUMN_TYPES,
+                                strings_can_be_null=True,
+                            ),
+                        )
+                    except pa.ArrowKeyError as e:
+                        # Raise error if an expected column is missing
+                        raise ValueError(f"Expected column not found in dataset: {e}")
+
+                    # Filter each block for key food safety issues
+                    filtered_batches = []
+                    for batch in reader:
+                        filtered_batches.append(batch.filter(food_issue_mask(batch.column('Issue'))))
+                finally:
+                    # urllib returns a short body instead of raising when the server closes early
+                    if response.length and response.isclosed():
+                        raise IncompleteRead(b"", response.length)
+
+            # Save filtered records as a typed, compressed Parquet file
+            food_recalls = pa.Table.from_batches(filtered_batches, schema=reader.schema)
+            pq.write_table(food_recalls, output_path, compression="zstd")
+            logger.info("Filtered food recalls saved as: %s", output_path)
+
+            if write_csv_enabled():
+                csv_path = os.path.splitext(output_path)[0] + ".csv"
+                pacsv.write_csv(food_recalls, csv_path)
+                logger.info("CSV copy saved as: %s", csv_path)
+            logger.info("Found %d food recalls.", food_recalls.num_rows)
+            return food_recalls
+        except HTTPError as e:
+            raise Exception(f"HTTP error {e.code} while downloading file: {e}")
+        except (IncompleteRead, TimeoutError, ConnectionError, URLError) as e:
+            if attempt == max_retries:
+                # Give up instead of returning nothing once every attempt has failed
+                raise ConnectionError(f"Download failed after {max_retries} attempts: {type(e).__name__} - {e}") from e
+            delay = 5 * attempt
+            logger.warning("Attempt %d: %s - %s. Retrying in %d seconds...", attempt, type(e).__name__, e, delay)
+            time.sleep(delay)
 
-def main():
+def main() -> pd.DataFrame:
     """
-    Main function to run the download and filtering steps for CFIA recall data.
+    Main function to run the download and filtering step for CFIA recall data.
+
+    Returns:
+        pd.DataFrame: The filtered food recall records, so the pipeline can pass them on in memory.
     """
+    logging.basicConfig(level=os.getenv("CFIA_LOG_LEVEL", "WARNING").upper())
+
     # CFIA open data source for recalls
     url = "https://recalls-rappels.canada.ca/sites/default/files/opendata-donneesouvertes/HCRSAMOpenData.csv"
 
     # Target folder and dynamic filenames
     folder = "recalls"
-    filtered_path = os.path.join(folder, "cfia_food_recalls.csv")
-
-    downloaded_file = download_raw_csv(url, folder)
+    filtered_path = os.path.join(folder, "cfia_food_recalls.parquet")
 
-    # Filter for relevant food recall records
-    filter_food_recalls(downloaded_file, filtered_path)
+    # Download and filter for relevant food recall records
+    food_recalls = extract_food_recalls(url, filtered_path)
+    return food_recalls.to_pandas(types_mapper=pd.ArrowDtype)
 
 if __name__ == "__main__":
     try:
         main()
     except Exception as e:
-        print(f"Pipeline failed: {e}", file=sys.stderr)
+        logger.error("Pipeline failed: %s", e)
         sys.exit(1)  # Forces non-zero exit code so GitHub Actions fails
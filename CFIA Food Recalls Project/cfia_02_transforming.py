@@ -1,28 +1,55 @@
 import pandas as pd
+import pyarrow as pa
+import pyarrow.parquet as pq
 from pathlib import Path
 import subprocess
-import traceback
+import logging
+import os
 import numpy as np
-import re
 from datetime import datetime
 import pytz
+from cfia_01_extracting import COLUMNS, write_csv_enabled
+
+logger = logging.getLogger(__name__)
+
+# Phrases in recall titles that follow the product name
+_TRIGGERS = (
+    r"recalled due to",
+    r"recalled",
+    r"may contain",
+    r"may be contaminated with",
+    r"due to",
+    r"possible contamination with",
+    r"possible presence of",
+    r"may be unsafe",
+)
+
+# Product name: the text after the first "in " if present, otherwise the text before the first trigger phrase
+_PRODUCT_NAME_PATTERN = (
+    r"(?i)^(?:(?s:.*?)\bin (?P<after_in>.*)"
+    r"|(?P<before_trigger>.*?)\s*(?:" + "|".join(_TRIGGERS) + r"))"
+)
+
+# Columns with only a few distinct values, stored as categories after processing
+CATEGORICAL_COLUMNS = ("Recall class", "Main issue", "Secondary issue", "Bacteria subtype", "Category")
 
 def load_recall_data(recalls_file_path: Path) -> pd.DataFrame:
     """
     Load the recall data from the given file path.
 
     Args:
-        recalls_file_path (Path): The full path to the recall CSV file.
+        recalls_file_path (Path): The full path to the recall Parquet file.
 
     Returns:
         pd.DataFrame: A DataFrame with the loaded data, or empty if file not found.
     """
     # Check if the file exists and read it
     if recalls_file_path.exists():
-        print(f"Successfully read {recalls_file_path.name}")
-        return pd.read_csv(recalls_file_path)
+        logger.info("Successfully read %s", recalls_file_path.name)
+        # Read only the needed columns; Parquet keeps the column types so nothing is re-parsed
+        return pd.read_parquet(recalls_file_path, columns=COLUMNS, dtype_backend="pyarrow")
     else:
-        print(f"File {recalls_file_path.name} does not exist.")
+        logger.warning("File %s does not exist.", recalls_file_path.name)
         return pd.DataFrame() # Create an empty data frame to avoid an error
 
 def clean_recalls_data(df_recalls: pd.DataFrame) -> pd.DataFrame:
@@ -38,16 +65,13 @@ def clean_recalls_data(df_recalls: pd.DataFrame) -> pd.DataFrame:
     # Check initial shape
     initial_shape = df_recalls.shape
 
-    # Get all duplicated values in the data frame
-    duplicates = df_recalls[df_recalls.duplicated(keep=False)]
-    print(f"\nTotal duplicated values: {duplicates.shape}")
-
-    # Drop duplicates 
+    # Drop duplicates and report how many rows were removed
     df_recalls_clean = df_recalls.drop_duplicates()
+    logger.info("Total duplicated rows dropped: %d", initial_shape[0] - len(df_recalls_clean))
 
-    # Get all NA values in the data frame
-    total_nas = df_recalls_clean.isna().sum()
-    print(f"\nTotal missing values:\n{total_nas}")
+    # Get all NA values in the data frame (only counted when they will be shown)
+    if logger.isEnabledFor(logging.DEBUG):
+        logger.debug("Total missing values:\n%s", df_recalls_clean.isna().sum())
 
     # Drop null values in 'Recall class' column
     df_recalls_clean = df_recalls_clean.dropna(subset=["Recall class"])
@@ -55,40 +79,26 @@ def clean_recalls_data(df_recalls: pd.DataFrame) -> pd.DataFrame:
     # Drop columns where 'Recall class' column contains '--' since this is a key feature for future analysis
     df_recalls_clean = df_recalls_clean[df_recalls_clean['Recall class'] != '--']
 
-    print(f"\nCleaned data: {initial_shape} → {df_recalls_clean.shape}")
+    logger.info("Cleaned data: %s → %s", initial_shape, df_recalls_clean.shape)
     return df_recalls_clean
 
-def extract_product_name(title):
+def extract_product_name(titles: pd.Series) -> pd.Series:
     """
-    Extracts the product name from the given title.
+    Extracts the product names from the given titles.
     
-    This function attempts to capture the product name by using regular expressions.
+    This function captures the product name with _PRODUCT_NAME_PATTERN, applied to the whole column at once:
+    the text after the first "in " is used if present, otherwise the text before the first trigger phrase.
 
     Args:
-        title (str): The title of the recall item that contains the product name.
+        titles (pd.Series): The titles of the recall items that contain the product names.
 
     Returns:
-        str: The extracted product name, or None if no product name could be found.
+        pd.Series: The extracted product names, or missing values where no product name could be found.
     """
-    match = re.search(r"\bin (.*)", title, re.IGNORECASE)
-    if match:
-        return match.group(1).strip()
-        
-    triggers = [
-        r"recalled due to",
-        r"recalled",
-        r"may contain",
-        r"may be contaminated with",
-        r"due to",
-        r"possible contamination with",
-        r"possible presence of",
-        r"may be unsafe"
-    ]
-    pattern = r"^(.*?)\s*(?=(" + "|".join(triggers) + r"))"
-    match = re.search(pattern, title, re.IGNORECASE)
-    if match:
-        return match.group(1).strip()
-    return None
+    # Run the regex with Arrow's string kernels; unmatched groups come back as empty strings
+    extracted = titles.astype(pd.ArrowDtype(pa.string())).str.extract(_PRODUCT_NAME_PATTERN)
+    after_in = extracted['after_in']
+    return after_in.mask(after_in.eq(''), extracted['before_trigger']).str.strip()
 
 def process_recalls_columns(df_recalls: pd.DataFrame) -> pd.DataFrame:
     """
@@ -101,10 +111,19 @@ def process_recalls_columns(df_recalls: pd.DataFrame) -> pd.DataFrame:
         pd.DataFrame: Updated DataFrame with modified columns.
     """
     # 'Recall class' contains 'Class 1 - Class 2' values that will be split into 2 different rows
-    df_recalls['Recall class'] = df_recalls['Recall class'].str.split(' - ')
+    # Only those rows are split, the rest are left untouched
+    has_multiple_classes = df_recalls['Recall class'].str.contains(' - ', regex=False, na=False)
+
+    if has_multiple_classes.any():
+        # Explode the list into separate rows
+        df_exploded = df_recalls.loc[has_multiple_classes].assign(**{
+            'Recall class': df_recalls.loc[has_multiple_classes, 'Recall class'].str.split(' - ')
+        }).explode('Recall class')
 
-    # Explode the list into separate rows
-    df_recalls = df_recalls.explode('Recall class', ignore_index=True)
+        # Put the exploded rows back in the place of their original row
+        df_recalls = pd.concat([df_recalls.loc[~has_multiple_classes], df_exploded]).sort_index(kind='stable')
+
+    df_recalls = df_recalls.reset_index(drop=True)
 
     # Map 'Recall class' column values to numbers and convert this column to numeric type
     df_recalls['Recall class'] = df_recalls['Recall class'].replace('Type II', 'Class 2').astype(str)
@@ -112,108 +131,136 @@ def process_recalls_columns(df_recalls: pd.DataFrame) -> pd.DataFrame:
     # Replace "E. Coli O157:H7" with "E. Coli - O157:H7" to standardize it for parse_issue function
     df_recalls['Issue'] = df_recalls['Issue'].replace('E. Coli O157:H7', 'E. Coli - O157:H7')
 
-    # Convert 'Archived' column to numeric type
-    df_recalls['Archived'] = df_recalls['Archived'].astype(int)
+    # Convert 'Archived' column to the smallest numeric type, since it only holds 0 or 1
+    df_recalls['Archived'] = df_recalls['Archived'].astype('int8')
+
+    # Store 'NID' in the smallest integer type that fits its values (the SQL column is INT)
+    df_recalls['NID'] = pd.to_numeric(df_recalls['NID'], downcast='integer')
 
-    # Apply the function only to rows where 'Product' is NaN
+    # Extract product names only for rows where 'Product' is NaN
     # This will ensure that only the missing product names are populated
-    df_recalls.loc[df_recalls['Product'].isna(), 'Product'] = df_recalls.loc[df_recalls['Product'].isna(), 'Title'].apply(extract_product_name)
+    missing_product = df_recalls['Product'].isna()
+    df_recalls.loc[missing_product, 'Product'] = extract_product_name(df_recalls.loc[missing_product, 'Title'])
 
     # Display the updated DataFrame with titles and their corresponding product names
-    print(df_recalls[['Title', 'Product']])
+    if logger.isEnabledFor(logging.DEBUG):
+        logger.debug("Titles and product names:\n%s", df_recalls[['Title', 'Product']])
 
     return df_recalls
 
-def parse_issue(issue):
+def parse_issue(issues: pd.Series) -> pd.DataFrame:
     """
-    Parses the recall issue string and extracts the main issue, any secondary issue or hazard, 
+    Parses the recall issue strings and extracts the main issue, any secondary issue or hazard, 
     and the subtype (if applicable).
 
-    The function splits the issue string by ' - ' and applies special logic for certain cases:
+    The function splits the issue strings by ' - ' and applies special logic for certain cases:
         - If the main issue is 'Listeria' and the secondary part is 'Food', the record is treated as 'Listeria' only, with no secondary issue.
         - For 'E. Coli', the first part after the dash is treated as the subtype, and if a third part exists, it is treated as a secondary issue/hazard.
         - For all other cases with a dash, the second part is treated as the secondary issue or hazard.
 
+    All rows are processed at once with vectorized string operations.
+
     Args:
-        issue (str): The issue description from the recall data.
+        issues (pd.Series): The issue descriptions from the recall data.
 
     Returns:
-        pd.Series: A Pandas Series with three elements:
-            - main_issue (str): The primary bacteria or hazard detected (e.g., 'Salmonella', 'Listeria', 'E. Coli').
-            - secondary_issue (str): Any additional hazard or bacteria present (blank if none or for 'Listeria - Food').
-            - subtype (str): The subtype/serotype for 'E. Coli' if present, otherwise blank.
+        pd.DataFrame: A DataFrame with the same index and three columns:
+            - Main issue (str): The primary bacteria or hazard detected (e.g., 'Salmonella', 'Listeria', 'E. Coli').
+            - Secondary issue (str): Any additional hazard or bacteria present (blank if none or for 'Listeria - Food').
+            - Bacteria subtype (str): The subtype/serotype for 'E. Coli' if present, otherwise blank.
     """
-    # Split by dash, remove leading/trailing whitespace
-    parts = [part.strip() for part in issue.split(' - ')]
-    main_issue = parts[0]
-    subtype = ''
-    secondary_issue = ''
-
-    if len(parts) > 1:
-        # If a second part exists and contains the word "Food", skip it
-        if main_issue.lower() == 'listeria' and parts[1].lower() == 'food':
-            pass
-        elif main_issue.lower().startswith('e. coli'):
-            # If a second part exists and the main issue is "E.Coli" it's a bacteria subtype
-            subtype = parts[1]
-            # If a third part exists and the main issue is "E.Coli", it's a second issue
-            if len(parts) > 2:
-                secondary_issue = parts[2]
-        else:
-            secondary_issue = parts[1]
-        
-    return pd.Series([main_issue, secondary_issue, subtype])
+    # Split by dash into the first three parts (blank if missing), remove leading/trailing whitespace
+    parts = issues.str.split(' - ', expand=True).reindex(columns=range(3)).fillna('')
+    main_issue = parts[0].str.strip()
+    second_part = parts[1].str.strip()
+    third_part = parts[2].str.strip()
+
+    main_issue_lower = main_issue.str.lower()
+    is_e_coli = main_issue_lower.str.startswith('e. coli')
+    # If the second part is "Food" and the main issue is "Listeria", skip it
+    is_listeria_food = main_issue_lower.eq('listeria') & second_part.str.lower().eq('food')
+
+    # If the main issue is "E.Coli" the second part is a bacteria subtype and the third part a second issue
+    subtype = second_part.where(is_e_coli, '')
+    secondary_issue = third_part.where(is_e_coli, second_part).mask(is_listeria_food, '')
+
+    return pd.DataFrame({
+        'Main issue': main_issue,
+        'Secondary issue': secondary_issue,
+        'Bacteria subtype': subtype,
+    })
 
 def save_processed_data (processed_file_path: Path, df_recalls_processed: pd.DataFrame):
     """
-    Save the processed recall data to a CSV file.
+    Save the processed recall data to a Parquet file, and to a CSV file if enabled.
 
     This function takes a DataFrame containing processed recall data and saves it 
-    to a specified file path including a timestamp comment in the first line to keep track of the last time it was updated.
-    The file is saved without including the index.
+    to a specified file path, keeping track of the last time it was updated: the timestamp is stored
+    in the Parquet file metadata and as a comment in the first line of the CSV file.
+    The files are saved without including the index.
 
     Args:
-        processed_file_path (Path): The full path where the processed data should be saved.
+        processed_file_path (Path): The full path where the processed Parquet file should be saved.
         df_recalls_processed (pd.DataFrame): The DataFrame containing the processed recall data.
 
     Returns:
-        None: This function saves the file to the disk and prints a success message.
+        None: This function saves the files to the disk and logs a success message.
     """
 
     # Generate ET timestamp
     eastern = pytz.timezone("America/Toronto")
     timestamp_et = datetime.now(eastern).strftime("%Y-%m-%d %H:%M:%S %Z")
 
-    # Open the file and write comment + updated data
-    with open(processed_file_path, "w", encoding="utf-8") as f:
-        f.write(f"# Last updated (ET): {timestamp_et}\n")
-        df_recalls_processed.to_csv(f, index=False, encoding="utf-8")
+    # Write the data with the timestamp added to the file metadata
+    table = pa.Table.from_pandas(df_recalls_processed, preserve_index=False)
+    table = table.replace_schema_metadata({**table.schema.metadata, b"last_updated_et": timestamp_et.encode()})
+    pq.write_table(table, processed_file_path, compression="zstd")
+
+    logger.info("Data successfully saved to %s", processed_file_path.name)
+
+    if write_csv_enabled():
+        csv_file_path = processed_file_path.with_suffix(".csv")
 
-    print(f"\nData successfully saved to {processed_file_path.name}")
+        # Open the file and write comment + updated data
+        with open(csv_file_path, "w", encoding="utf-8") as f:
+            f.write(f"# Last updated (ET): {timestamp_et}\n")
+            df_recalls_processed.to_csv(f, index=False, encoding="utf-8")
 
-def main():
+        logger.info("Data successfully saved to %s", csv_file_path.name)
+
+def main(df_recalls: pd.DataFrame | None = None) -> pd.DataFrame | None:
     """
     Main function to load and clean yesterday's recall data file.
+
+    Args:
+        df_recalls (pd.DataFrame, optional): Filtered recall data passed in memory by the pipeline.
+            If not given, it is read from the filtered recalls file.
+
+    Returns:
+        pd.DataFrame: The processed recall data, or None if it could not be processed.
     """
+    logging.basicConfig(level=os.getenv("CFIA_LOG_LEVEL", "WARNING").upper())
+
     # Convert string into Path object
     dir_path = Path("recalls")
 
     try:
         # Check if the directory exists
         if not dir_path.exists() or not dir_path.is_dir():
-            print(f"Directory {dir_path.name} does not exist.")
+            logger.warning("Directory %s does not exist.", dir_path.name)
             return
 
         # Get full path to read the file
-        filename = "cfia_food_recalls.csv"
+        filename = "cfia_food_recalls.parquet"
         recalls_file_path = dir_path / filename
         processed_file_path = dir_path / f"processed_{filename}"
 
-        # Call the function to get recalls data frame
-        df_recalls = load_recall_data(recalls_file_path)
+        # Call the function to get recalls data frame unless it was passed in
+        if df_recalls is None:
+            df_recalls = load_recall_data(recalls_file_path)
 
         if df_recalls.empty:
-            print(f"Data frame {filename} not found")
+            logger.warning("Data frame %s not found", filename)
             return
 
         # Call the function to clean the data frame (missing values, duplicates, etc.)
@@ -223,18 +270,21 @@ def main():
         df_recalls_processed = process_recalls_columns(df_recalls_clean)
 
         # Clasify Issues by Subcategories (Second Issue / Bacteria Subtype)
-        df_recalls_processed[['Main issue', 'Secondary issue', 'Bacteria subtype']] = df_recalls_processed['Issue'].apply(parse_issue)
+        df_recalls_processed[['Main issue', 'Secondary issue', 'Bacteria subtype']] = parse_issue(df_recalls_processed['Issue'])
+
+        # Store the low-cardinality columns as categories: small integer codes into a few distinct values
+        df_recalls_processed = df_recalls_processed.astype(dict.fromkeys(CATEGORICAL_COLUMNS, "category"))
 
         # Show a preview of the data
-        print(f"\n{df_recalls_processed.head(10)}")
+        logger.debug("Preview:\n%s", df_recalls_processed.head(10))
 
         # Call the script to save the processed data
         save_processed_data(processed_file_path, df_recalls_processed)
+        return df_recalls_processed
 
     except Exception as e:
-        # Catch and print any errors during the pipeline run
-        print(f"\nPipeline failed: {e}")
-        traceback.print_exc()  # This will print the full traceback, showing the exact line where the error occurred.
+        # Catch and log any errors during the pipeline run, with the full traceback showing the exact line where the error occurred
+        logger.exception("Pipeline failed: %s", e)
 
 if __name__ == "__main__":
     main()
@@ -1,14 +1,58 @@
 import pandas as pd
+import pyarrow as pa
+import pyarrow.parquet as pq
 from pathlib import Path
 import sqlalchemy 
 from sqlalchemy import text
 from dotenv import load_dotenv
+import logging
 import sys
 import os
 
 # Load variables from .env file
 load_dotenv()
 
+logger = logging.getLogger(__name__)
+
+# Processed file columns mapped to their SQL column names
+COLUMN_MAPPING = {
+    "NID": "NID",
+    "Title": "Title",
+    "URL": "URL",
+    "Product": "Product",
+    "Issue": "Issue",
+    "Main issue": "MainIssue",
+    "Secondary issue": "SecondaryIssue",
+    "Bacteria subtype": "BacteriaSubtype",
+    "Category": "Category",
+    "Recall class": "Class",
+    "Last updated": "LastUpdated",
+    "Archived": "IsArchived"
+}
+
+# Session temp table the records are uploaded to before inserting. Kept all lowercase: pandas
+# looks mixed-case names up in the table catalog, which never lists temp tables, and warns
+STAGING_TABLE = "#stg_foodrecalls"
+
+# Bounded text types for the staging table, matching dbo.FoodRecalls. Left to pandas these
+# would be VARCHAR(max), which pyodbc streams row by row even with fast_executemany.
+# 'LastUpdated' is sent as a native DATE instead of text that SQL Server has to convert
+STAGING_DTYPES = {
+    "Title": sqlalchemy.types.VARCHAR(500),
+    "URL": sqlalchemy.types.VARCHAR(500),
+    "Product": sqlalchemy.types.VARCHAR(255),
+    "Issue": sqlalchemy.types.VARCHAR(255),
+    "MainIssue": sqlalchemy.types.VARCHAR(255),
+    "SecondaryIssue": sqlalchemy.types.VARCHAR(255),
+    "BacteriaSubtype": sqlalchemy.types.VARCHAR(255),
+    "Category": sqlalchemy.types.VARCHAR(100),
+    "Class": sqlalchemy.types.VARCHAR(10),
+    "LastUpdated": sqlalchemy.types.Date()
+}
+
+# Rows sent per executemany batch when uploading to the staging table
+INSERT_CHUNKSIZE = 1000
+
 def get_sqlalchemy_engine():
     """
     Create and return a SQLAlchemy engine with fast_executemany enabled for SQL Server.
@@ -33,87 +77,115 @@ def get_sqlalchemy_engine():
     return engine
 
 
-def fetch_existing_ids(engine):
+def insert_new_records(conn, df_to_insert: pd.DataFrame) -> int:
+    """
+    Insert the records whose NID is not already in the FoodRecalls table.
+
+    The records are uploaded to a session temp table and the existing NIDs are filtered out
+    inside SQL Server (using the unique NID index), so they never have to be fetched.
+
+    Args:
+        conn: An open SQLAlchemy connection inside a transaction.
+        df_to_insert (pd.DataFrame): Records with columns named as in the FoodRecalls table.
+
+    Returns:
+        int: Number of records inserted.
     """
-    Fetch all existing NIDs from the FoodRecalls table using SQLAlchemy.
+    # Upload all records to the staging table. method=None uses executemany, which fast_executemany
+    # sends as one parameter array per chunk; multi-row VALUES would hit SQL Server's 2100 parameter limit
+    df_to_insert.to_sql(
+        STAGING_TABLE,
+        con=conn,
+        if_exists="replace",
+        index=False,
+        dtype=STAGING_DTYPES,
+        chunksize=INSERT_CHUNKSIZE,
+        method=None,
+    )
+
+    # Insert only the records that don't exist yet
+    columns = ", ".join(f"[{col}]" for col in df_to_insert.columns)
+    result = conn.execute(text(
+        f"INSERT INTO dbo.FoodRecalls ({columns}) "
+        f"SELECT {columns} FROM {STAGING_TABLE} AS s "
+        "WHERE NOT EXISTS (SELECT 1 FROM dbo.FoodRecalls AS f WHERE f.NID = s.NID)"
+    ))
+    conn.execute(text(f"DROP TABLE {STAGING_TABLE}"))
+    return result.rowcount
+
+def load_processed_data(processed_file_path: Path) -> pa.Table:
     """
-    with engine.connect() as conn:
-        result = conn.execute(text("SELECT NID FROM dbo.FoodRecalls"))
-        return {row[0] for row in result}
-    
-def main():
+    Load the mapped columns of the processed recall file into an Arrow table.
+
+    The Parquet file is memory-mapped and only the mapped columns are read,
+    with the column types stored by the transforming step.
+
+    Args:
+        processed_file_path (Path): The full path to the processed recall Parquet file.
+
+    Returns:
+        pa.Table: A table with the columns listed in COLUMN_MAPPING.
+    """
+    return pq.read_table(processed_file_path, columns=list(COLUMN_MAPPING), memory_map=True)
+
+def main(df_recalls: pd.DataFrame | None = None):
     """
         Main function to execute the data insertion pipeline.
 
         This function is the main entry point for the script. It performs the following tasks:
-        1. Reads the data from a CSV file into a Pandas DataFrame.
+        1. Reads the data from a Parquet file, unless it was passed in as a DataFrame.
         2. Connects to the SQL Server database.
-        3. Fetches the existing IDs from the database to check for duplicates.
+        3. Uploads the records to a staging table in the database.
         4. Inserts new records (those not already in the database) into the SQL Server.
         5. Handles exceptions and ensures that any errors are reported.
 
-        If the script encounters an error during execution, it will print the error message 
+        If the script encounters an error during execution, it will log the error message 
         and halt the process.
+
+        Args:
+            df_recalls (pd.DataFrame, optional): Processed recall data passed in memory by the pipeline.
     """
-     # Convert string into Path object
-    dir_path = Path("recalls")
+    logging.basicConfig(level=os.getenv("CFIA_LOG_LEVEL", "WARNING").upper())
 
-    # Check if the directory exists
-    if not dir_path.exists() or not dir_path.is_dir():
-        print(f"Directory {dir_path.name} does not exist.")
-        sys.exit(1)
+    if df_recalls is None:
+        # Convert string into Path object
+        dir_path = Path("recalls")
 
-    # Call function to get yesterday's file name
-    filename = "processed_cfia_food_recalls.csv"
-    processed_file_path = dir_path / filename
-    
-    # Read the CSV file into a DataFrame and ignore timestamp comment
-    df = pd.read_csv(processed_file_path, comment="#")
+        # Check if the directory exists
+        if not dir_path.exists() or not dir_path.is_dir():
+            logger.error("Directory %s does not exist.", dir_path.name)
+            sys.exit(1)
+
+        # Call function to get yesterday's file name
+        filename = "processed_cfia_food_recalls.parquet"
+        processed_file_path = dir_path / filename
+        
+        # Read only the mapped columns
+        df_recalls = load_processed_data(processed_file_path).to_pandas()
 
     # Connect with SQLAlchemy engine
     engine = get_sqlalchemy_engine()
 
     try:
-        # Fetch existing IDs to avoid duplicates
-        existing_ids = fetch_existing_ids(engine)
-        print(f"Found {len(existing_ids)} existing IDs in the database.")
-
-        # Filter out records that already exist
-        df_new = df[~df['NID'].isin(existing_ids)]
-
-        if not df_new.empty:
+        if not df_recalls.empty:
             # Prepare DataFrame for SQL (rename columns if needed)
-            column_mapping = {
-                "NID": "NID",
-                "Title": "Title",
-                "URL": "URL",
-                "Product": "Product",
-                "Issue": "Issue",
-                "Main issue": "MainIssue",
-                "Secondary issue": "SecondaryIssue",
-                "Bacteria subtype": "BacteriaSubtype",
-                "Category": "Category",
-                "Recall class": "Class",
-                "Last updated": "LastUpdated",
-                "Archived": "IsArchived"
-            }
-            # Only use columns present in both DataFrame and mapping
-            columns_to_use = [col for col in column_mapping.keys() if col in df_new.columns]
-            df_to_insert = df_new[columns_to_use].rename(columns=column_mapping)
+            df_to_insert = df_recalls[list(COLUMN_MAPPING)].rename(columns=COLUMN_MAPPING)
+
+            # Cast categorical columns back to plain values (to_sql sends them as objects anyway),
+            # since replace can't add None to their categories, and store blank text as NULL
+            categorical_columns = df_to_insert.select_dtypes("category").columns
+            df_to_insert = df_to_insert.astype(dict.fromkeys(categorical_columns, object)).replace('', None)
             
-            # Insert
+            # Insert, skipping records that already exist
             with engine.begin() as conn:
-                df_to_insert.to_sql(
-                    "FoodRecalls",
-                    con=conn,            
-                    schema="dbo",        
-                    if_exists="append",
-                    index=False,
-                    method=None,         
-                )
-            print(f"{len(df_to_insert)} records inserted successfully.")
+                inserted = insert_new_records(conn, df_to_insert)
+        else:
+            inserted = 0
+
+        if inserted:
+            logger.info("%d records inserted successfully.", inserted)
         else:
-            print("No new records to insert.")
+            logger.info("No new records to insert.")
     finally:
         # ensure pool is torn down in all cases
         engine.dispose()
@@ -9,47 +9,61 @@ This script sequentially:
     3. Uploads the processed data to a SQL database.
 
 Usage:
-    poetry run python run_cfia_pipeline.py
+    poetry run python cfia_run_pipeline.py
 
-Each step is executed as a separate script using subprocess for modularity and maintainability.
+Each step's main() is imported and called in the same process, and the data is passed
+in memory from one step to the next. The step scripts can still be run on their own.
 
 Author: Salma Milla Gallegos
 Date: 11/06/2025
 """
 
-import subprocess
+import logging
+import os
+import sys
+
+from cfia_01_extracting import main as extract
+from cfia_02_transforming import main as transform
+from cfia_03_loading import main as load
+
+logger = logging.getLogger(__name__)
 
 def run_pipeline():
     """
-    Runs the CFIA food recalls ETL pipeline by executing each processing script in sequence:
+    Runs the CFIA food recalls ETL pipeline by calling each processing step in sequence:
         1. Downloads and filters the data.
         2. Cleans the filtered data.
         3. Uploads the cleaned data to the SQL database.
 
-    If any step fails, the process will stop and print an error message.
+    If any step fails, the process will stop, log the error with its traceback and re-raise it.
     """
-    print("Starting CFIA data pipeline...")
+    logging.basicConfig(level=os.getenv("CFIA_LOG_LEVEL", "WARNING").upper())
+
+    logger.info("Starting CFIA data pipeline...")
 
     try:
         # Step 1: Extract and filter the data
-        script_name = "cfia_01_extracting.py"
-        print(f"\nRunning extracting script: ...")
-        subprocess.run(["poetry", "run", "python", script_name], check=True)
-        
+        logger.info("Running extracting step: cfia_01_extracting...")
+        df_recalls = extract()
+
         # Step 2: Transform the filtered data
-        script_name = "cfia_02_transforming.py"
-        print(f"\nRunning transforming script: {script_name}...")
-        subprocess.run(["poetry", "run", "python", script_name], check=True)
-        
+        logger.info("Running transforming step: cfia_02_transforming...")
+        df_recalls_processed = transform(df_recalls)
+        if df_recalls_processed is None:
+            raise RuntimeError("Transforming step did not produce any processed data.")
+
         # Step 3: Load the cleaned data to SQL
-        script_name = "cfia_03_loading.py"
-        print(f"\nRunning loading script: {script_name}...")
-        subprocess.run(["poetry", "run", "python", script_name], check=True)
+        logger.info("Running loading step: cfia_03_loading...")
+        load(df_recalls_processed)
 
-        print("\nPipeline completed successfully.")
+        logger.info("Pipeline completed successfully.")
 
-    except subprocess.CalledProcessError as e:
-        print(f"\nPipeline failed: {e}")
+    except Exception as e:
+        logger.exception("Pipeline failed: %s", e)
+        raise
 
 if __name__ == "__main__":
-    run_pipeline()
+    try:
+        run_pipeline()
+    except Exception:
+        sys.exit(1)  # Forces non-zero exit code so GitHub Actions fails